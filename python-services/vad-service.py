@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+VAD Pacing Service
+Measures actual speech duration in audio files using Silero VAD
+Used to compare Veo reference pacing against user recordings
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import logging
+from math import gcd
+
+import numpy as np
+import soundfile as sf
+import torch
+from scipy.signal import resample_poly
+
+# Configure logging (stderr only — stdout is reserved for JSON results)
+logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+logger = logging.getLogger(__name__)
+
+# Torch runtime tuning: size the thread pool to the cores this process can
+# actually use and drop autograd bookkeeping — this is inference-only
+torch.set_num_threads(len(os.sched_getaffinity(0)))
+torch.set_grad_enabled(False)
+
+# Silero VAD operates on 16kHz mono audio
+TARGET_SAMPLE_RATE = 16000
+
+# Silero model singleton — torch.hub.load re-scans the hub cache and
+# re-instantiates the model on every call, so load it once per process
+_MODEL = None
+_UTILS = None
+
+INT8_MODEL_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'silero_vad_int8.onnx'
+)
+
+
+def _quantize_vad(model):
+    """
+    Swap the fp32 Silero ONNX model for an INT8 dynamically-quantized copy
+
+    Falls back to the fp32 model if quantization is unavailable.
+    """
+    try:
+        if not os.path.exists(INT8_MODEL_PATH):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            src = glob.glob(os.path.join(
+                torch.hub.get_dir(), 'snakers4_silero-vad_*', 'files', 'silero_vad.onnx'
+            ))
+            if not src:
+                logger.warning("silero_vad.onnx not found in hub cache, using fp32 model")
+                return model
+            logger.info("Quantizing Silero VAD to INT8...")
+            quantize_dynamic(src[0], INT8_MODEL_PATH, weight_type=QuantType.QInt8)
+        # Rebuild silero's OnnxWrapper around the quantized model file
+        return type(model)(INT8_MODEL_PATH)
+    except Exception as e:
+        logger.warning(f"INT8 quantization unavailable, using fp32 ONNX model: {e}")
+        return model
+
+
+def _get_vad():
+    """Load the Silero VAD ONNX model once and reuse it for every call"""
+    global _MODEL, _UTILS
+    if _MODEL is None:
+        logger.info("Loading Silero VAD model (ONNX)...")
+        model, _UTILS = torch.hub.load(
+            repo_or_dir='snakers4/silero-vad',
+            model='silero_vad',
+            force_reload=False,
+            trust_repo=True,
+            onnx=True
+        )
+        _MODEL = _quantize_vad(model)
+    return _MODEL, _UTILS
+
+
+def get_speech_duration(audio_path: str) -> dict:
+    """
+    Measure total speech duration in an audio file using Silero VAD
+
+    Args:
+        audio_path: Path to the audio file
+
+    Returns:
+        Dict with total duration, speech duration, and speech segments
+    """
+    # Downmix and resample one-second blocks into a preallocated 16kHz
+    # buffer — sf.read plus whole-file downmix and resample holds ~3x the
+    # file in RAM, while this path stays bounded at one block
+    with sf.SoundFile(audio_path) as f:
+        sample_rate = f.samplerate
+        total_duration = f.frames / sample_rate
+
+        g = gcd(sample_rate, TARGET_SAMPLE_RATE)
+        up, down = TARGET_SAMPLE_RATE // g, sample_rate // g
+
+        audio_data = np.empty(
+            int(f.frames * TARGET_SAMPLE_RATE / sample_rate) + 16, dtype=np.float32
+        )
+        pos = 0
+        for block in f.blocks(blocksize=sample_rate, dtype='float32', always_2d=True):
+            mono = block.mean(axis=1)
+            if sample_rate != TARGET_SAMPLE_RATE:
+                # Polyphase FIR resample (anti-aliased, runs in C)
+                mono = resample_poly(mono, up, down)
+            audio_data[pos:pos + len(mono)] = mono
+            pos += len(mono)
+        audio_data = audio_data[:pos]
+
+    model, utils = _get_vad()
+    (get_speech_timestamps, _, _, _, _) = utils
+
+    wav = torch.from_numpy(audio_data)
+    with torch.inference_mode():
+        speech_timestamps = get_speech_timestamps(
+            wav, model, sampling_rate=TARGET_SAMPLE_RATE, return_seconds=True
+        )
+
+    speech_duration = sum(ts['end'] - ts['start'] for ts in speech_timestamps)
+
+    return {
+        "total_duration": float(total_duration),
+        "speech_duration": float(speech_duration),
+        "segments": [
+            {"start": float(ts['start']), "end": float(ts['end'])}
+            for ts in speech_timestamps
+        ]
+    }
+
+
+def analyze_pacing(veo_path: str, user_path: str) -> dict:
+    """
+    Compare speech pacing between a Veo reference and a user recording
+
+    Args:
+        veo_path: Path to the Veo reference audio
+        user_path: Path to the user recording
+
+    Returns:
+        Dict with per-file speech stats and the user/veo pace ratio
+    """
+    logger.info(f"Analyzing pacing: veo={veo_path} user={user_path}")
+
+    veo = get_speech_duration(veo_path)
+    user = get_speech_duration(user_path)
+
+    pace_ratio = (
+        user['speech_duration'] / veo['speech_duration']
+        if veo['speech_duration'] > 0 else 0.0
+    )
+
+    return {
+        "status": "success",
+        "veo": veo,
+        "user": user,
+        "pace_ratio": float(pace_ratio)
+    }
+
+
+def run_worker():
+    """
+    Long-lived worker mode: load the model once, then serve one JSON request
+    per stdin line ({"veo": path, "user": path}) with one JSON result per
+    stdout line. Amortizes the 1-3s model load across every VAD call instead
+    of paying it per process spawn.
+    """
+    _get_vad()
+    logger.info("VAD worker ready")
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            result = analyze_pacing(request['veo'], request['user'])
+        except Exception as e:
+            logger.error(f"Pacing analysis failed: {e}", exc_info=True)
+            result = {"status": "error", "error": str(e)}
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VAD-based speech pacing analysis")
+    parser.add_argument("veo_path", nargs="?", help="Veo reference audio file")
+    parser.add_argument("user_path", nargs="?", help="User recording audio file")
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="Run as a long-lived stdin/stdout worker instead of one-shot CLI"
+    )
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+    else:
+        if not args.veo_path or not args.user_path:
+            parser.error("veo_path and user_path are required in one-shot mode")
+        try:
+            result = analyze_pacing(args.veo_path, args.user_path)
+        except Exception as e:
+            logger.error(f"Pacing analysis failed: {e}", exc_info=True)
+            result = {"status": "error", "error": str(e)}
+        print(json.dumps(result))